@@ -1,11 +1,15 @@
 import os
 import asyncio
+import hashlib
+import time
 from datetime import datetime
-from threading import Thread
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import CommandStart, Command
-from flask import Flask, render_template_string
-import requests
+from jinja2 import Template
+import aiohttp
+from aiohttp import web
+import orjson
+from pybloom_live import ScalableBloomFilter
 from collections import Counter
 import re
 
@@ -20,65 +24,216 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY","demo")
 # Initialize Bot + Dispatcher
 bot = Bot(BOT_TOKEN)
 dp = Dispatcher()
-app = Flask(__name__)
 
 # -------------------------------
 # Data Storage
 # -------------------------------
 if USE_DATABASE:
-    from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text
+    from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Index, select, func, inspect, text as sa_text
     from sqlalchemy.ext.declarative import declarative_base
-    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-    engine = create_engine(DB_URL, echo=False)
+    # Async driver + pool: the event loop is released during DB I/O and
+    # writes no longer serialize on a single connection.
+    db_url = DB_URL.replace("sqlite:///", "sqlite+aiosqlite:///")
+    if db_url.startswith("sqlite"):
+        # aiosqlite uses NullPool for file databases and rejects sizing args
+        pool_kwargs = {}
+    else:
+        pool_kwargs = dict(pool_size=20, max_overflow=40,
+                           pool_pre_ping=True, pool_recycle=3600)
+    engine = create_async_engine(db_url, echo=False, **pool_kwargs)
     Base = declarative_base()
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    AsyncSessionMaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    if engine.url.get_backend_name() == "sqlite":
+        from sqlalchemy import event
+
+        # WAL + synchronous=NORMAL: one cheap fsync per batch commit
+        # instead of a full journal sync per transaction.
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_conn, connection_record):
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.close()
 
     class Message(Base):
         __tablename__ = 'messages'
+        # Covering index so the profanity leaderboard GROUP BY is index-only
+        __table_args__ = (Index("ix_msg_profane_user", "profane", "username"),)
         id = Column(Integer, primary_key=True)
-        timestamp = Column(DateTime, default=datetime.utcnow)
+        # client-side default kept: tables created before this column had a
+        # DDL default would otherwise store NULL (server_default is only
+        # DDL at table creation)
+        timestamp = Column(DateTime, default=datetime.utcnow, server_default=func.now())
         chat_id = Column(String)
         user_id = Column(String)
         username = Column(String)
         text = Column(Text)
         profane = Column(Boolean)
+        hashtags = Column(Text)  # space-joined, extracted once at write time
 
     class MemberEvent(Base):
         __tablename__ = 'member_events'
         id = Column(Integer, primary_key=True)
-        timestamp = Column(DateTime, default=datetime.utcnow)
+        timestamp = Column(DateTime, default=datetime.utcnow, server_default=func.now())
         chat_id = Column(String)
         user_id = Column(String)
         username = Column(String)
         event_type = Column(String)
 
-    Base.metadata.create_all(engine)
+    async def ensure_schema():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            # create_all never alters existing tables; add the hashtags
+            # column to databases created before it existed.
+            def missing_hashtags(sync_conn):
+                cols = inspect(sync_conn).get_columns("messages")
+                return all(c["name"] != "hashtags" for c in cols)
+            if await conn.run_sync(missing_hashtags):
+                await conn.execute(sa_text("ALTER TABLE messages ADD COLUMN hashtags TEXT"))
+
+    async def rebuild_counters():
+        """Warm the dashboard aggregates from stored history at startup."""
+        async with AsyncSessionMaker() as s:
+            # Counts and the leaderboard aggregate in SQL; only result
+            # tuples cross the wire.
+            STATS["messages"] = (await s.execute(
+                select(func.count(Message.id))
+            )).scalar_one()
+            prof_rows = (await s.execute(
+                select(Message.username, func.count(Message.id))
+                .where(Message.profane.is_(True))
+                .group_by(Message.username)
+            )).all()
+            PROFANE_COUNTER.update(dict(prof_rows))
+            evt_counts = Counter(
+                (await s.execute(select(MemberEvent.event_type))).scalars()
+            )
+            tag_cols = (await s.execute(select(Message.hashtags))).scalars().all()
+        STATS["joins"] = evt_counts["join"]
+        STATS["leaves"] = evt_counts["leave"]
+        for tags in tag_cols:
+            # rows from before the column migration carry NULL
+            if tags:
+                HASHTAG_COUNTER.update(tags.split())
 else:
     # In-memory storage
     messages = []
     member_events = []
 
+# -------------------------------
+# Dashboard Aggregates
+# -------------------------------
+# Updated incrementally by the handlers so /dashboard renders in O(1)
+# instead of rescanning every stored message per hit.
+STATS = {"messages": 0, "joins": 0, "leaves": 0}
+HASHTAG_COUNTER = Counter()
+PROFANE_COUNTER = Counter()
+
+# -------------------------------
+# Write Batching
+# -------------------------------
+# Handlers append rows here instead of writing synchronously; flusher()
+# drains the buffer in one batched write per cycle so the event loop
+# never blocks on storage I/O mid-message. In DB mode the buffer holds
+# ORM objects (messages and member events alike) and each batch costs a
+# single add_all + commit.
+PENDING_ROWS = []
+FLUSH_LOCK = asyncio.Lock()
+FLUSH_INTERVAL = 5      # seconds between background flushes
+FLUSH_MAX_ROWS = 500    # flush early if the buffer grows past this
+FLUSHER_TASK = None     # strong ref; the loop only holds weak refs to tasks
+
+async def flush_pending():
+    async with FLUSH_LOCK:
+        if not PENDING_ROWS:
+            return
+        batch = PENDING_ROWS[:]
+        PENDING_ROWS.clear()
+    try:
+        if USE_DATABASE:
+            async with AsyncSessionMaker() as s:
+                s.add_all(batch)
+                await s.commit()
+        else:
+            messages.extend(batch)
+    except Exception as exc:
+        # Re-queue in order so a transient DB error doesn't drop the batch
+        # or kill the flusher loop; the next cycle retries.
+        PENDING_ROWS[:0] = batch
+        print(f"flush failed, re-queued {len(batch)} rows: {exc}")
+
+async def flusher():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await flush_pending()
+
 # -------------------------------
 # Profanity / AI Functions
 # -------------------------------
 BAD_WORDS = ["madarchod","bhosdike","chutiya","gaand","bc"]
-premium_users = set()  # manually add premium user IDs
+
+# Premium user IDs, comma-separated in the environment; frozen at boot so
+# the hot path does a single lock-free hash lookup.
+PREMIUM = frozenset(
+    int(uid) for uid in os.getenv("PREMIUM_USER_IDS", "").split(",") if uid.strip()
+)
+
+# Chats whose messages get the full analysis pipeline even without a
+# premium sender (comma-separated chat IDs).
+TRACKED_CHATS = frozenset(
+    int(cid) for cid in os.getenv("TRACKED_CHAT_IDS", "").split(",") if cid.strip()
+)
+
+# BAD_WORDS are all ASCII transliterations, so the scan runs over UTF-8
+# bytes: casefold once, encode once, then a single C-level pass of a
+# precompiled alternation. Explicit lookarounds instead of \b: in bytes
+# patterns \b is ASCII-only, so any UTF-8 continuation byte would count
+# as a boundary and "bc" glued to Devanagari text would match. Bytes
+# >= 0x80 are treated as word bytes here.
+_WORD_BYTE = rb"[0-9A-Za-z_\x80-\xff]"
+BAD_RE = re.compile(
+    rb"(?<!" + _WORD_BYTE + rb")(?:"
+    + b"|".join(re.escape(w.encode()) for w in BAD_WORDS)
+    + rb")(?!" + _WORD_BYTE + rb")"
+)
 
 def is_profane(text):
-    return any(word in text.lower() for word in BAD_WORDS)
+    """Whole-word bad-word check over the casefolded text."""
+    return BAD_RE.search(text.casefold().encode("utf-8", "ignore")) is not None
+
+# Compiled once; \w stays Unicode-aware so non-Latin tags keep matching,
+# and only the matched tags are lowercased instead of the whole text.
+HASHTAG_RE = re.compile(r"#\w+")
 
 def extract_hashtags(text):
-    return re.findall(r"#\w+", text.lower())
+    return [m.group(0).lower() for m in HASHTAG_RE.finditer(text)]
+
+# Bloom filter over normalized message texts: repeats ("ok", "lol", ...)
+# skip the Gemini round-trip entirely.
+SEEN_TEXTS = ScalableBloomFilter(initial_capacity=100_000, error_rate=0.001)
+
+def seen_before(text):
+    key = hashlib.blake2b(text.strip().lower().encode(), digest_size=16).digest()
+    if key in SEEN_TEXTS:
+        return True
+    SEEN_TEXTS.add(key)
+    return False
 
-def run_gemini_analysis(text):
+# Shared HTTP session (keep-alive, no per-call TLS handshake), created in main()
+AIO_SESSION = None
+GEMINI_SEM = asyncio.Semaphore(16)  # cap concurrent outbound AI requests
+
+async def run_gemini_analysis(text):
     """Lite AI Analysis for Premium Users"""
     headers = {"Authorization": f"Bearer {GEMINI_API_KEY}"}
     data = {"input": text, "model": "gemini-2.5-flash-lite"}
     try:
-        res = requests.post("https://api.openai.com/v1/responses", headers=headers, json=data, timeout=5)
-        r = res.json()
+        async with GEMINI_SEM:
+            async with AIO_SESSION.post("https://api.openai.com/v1/responses", headers=headers, json=data) as res:
+                r = orjson.loads(await res.read())
         keywords = r.get("keywords", [])
         sentiment = r.get("sentiment", "neutral")
         return keywords, sentiment
@@ -95,7 +250,7 @@ async def start_cmd(msg: types.Message):
 @dp.message(Command("dashboard"))
 async def dashboard_cmd(msg: types.Message):
     user_id = msg.from_user.id
-    if user_id in premium_users:
+    if user_id in PREMIUM:
         await msg.reply("🔥 Premium: AI & leaderboard enabled. Visit /dashboard")
     else:
         await msg.reply("📊 Free: Basic analytics only. Visit /dashboard")
@@ -104,23 +259,39 @@ async def dashboard_cmd(msg: types.Message):
 async def log_message(msg: types.Message):
     if not msg.text:
         return
+    is_premium = msg.from_user.id in PREMIUM
+
+    # Free traffic outside tracked chats only feeds the message total;
+    # skip the profanity/hashtag/storage work entirely.
+    if not is_premium and msg.chat.id not in TRACKED_CHATS:
+        STATS["messages"] += 1
+        return
+
     profane = is_profane(msg.text)
     hashtags = extract_hashtags(msg.text)
 
-    # Save message
+    # Keep dashboard aggregates current
+    STATS["messages"] += 1
+    if hashtags:
+        HASHTAG_COUNTER.update(hashtags)
+    if profane:
+        PROFANE_COUNTER[msg.from_user.username] += 1
+
+    # Save message (buffered; flusher() writes in batches)
     if USE_DATABASE:
         m = Message(
             chat_id=str(msg.chat.id),
             user_id=str(msg.from_user.id),
             username=msg.from_user.username,
             text=msg.text,
-            profane=profane
+            profane=profane,
+            hashtags=" ".join(hashtags)
         )
-        session.add(m)
-        session.commit()
+        PENDING_ROWS.append(m)
     else:
-        messages.append({
-            "timestamp": datetime.utcnow(),
+        PENDING_ROWS.append({
+            # int nanoseconds; format with datetime.fromtimestamp only at display
+            "ts_ns": time.time_ns(),
             "chat_id": str(msg.chat.id),
             "user_id": str(msg.from_user.id),
             "username": msg.from_user.username,
@@ -128,14 +299,16 @@ async def log_message(msg: types.Message):
             "profane": profane,
             "hashtags": hashtags
         })
+    if len(PENDING_ROWS) >= FLUSH_MAX_ROWS:
+        await flush_pending()
 
     # Profanity alert
-    if profane and msg.from_user.id in premium_users:
+    if profane and is_premium:
         await msg.reply("⚠️ Abusive language detected!")
 
-    # Optional AI for premium
-    if msg.from_user.id in premium_users:
-        keywords, sentiment = run_gemini_analysis(msg.text)
+    # Optional AI for premium (skipped for texts we've already analyzed)
+    if is_premium and not seen_before(msg.text):
+        keywords, sentiment = await run_gemini_analysis(msg.text)
         print(f"Premium AI Analysis: {keywords}, {sentiment}")
 
 @dp.chat_member()
@@ -148,6 +321,7 @@ async def member_update(event: types.ChatMemberUpdated):
         event_type = "leave"
 
     if event_type:
+        STATS["joins" if event_type == "join" else "leaves"] += 1
         if USE_DATABASE:
             e = MemberEvent(
                 chat_id=str(event.chat.id),
@@ -155,11 +329,10 @@ async def member_update(event: types.ChatMemberUpdated):
                 username=user.username,
                 event_type=event_type
             )
-            session.add(e)
-            session.commit()
+            PENDING_ROWS.append(e)
         else:
             member_events.append({
-                "timestamp": datetime.utcnow(),
+                "ts_ns": time.time_ns(),
                 "chat_id": str(event.chat.id),
                 "user_id": str(user.id),
                 "username": user.username,
@@ -167,90 +340,91 @@ async def member_update(event: types.ChatMemberUpdated):
             })
 
 # -------------------------------
-# Flask Web Dashboard
+# Web Dashboard (aiohttp, same event loop as the bot)
 # -------------------------------
-@app.route("/dashboard")
-def dashboard():
-    # Fetch data
-    if USE_DATABASE:
-        msgs = session.query(Message).all()
-        evts = session.query(MemberEvent).all()
-    else:
-        msgs = messages
-        evts = member_events
-
-    total_messages = len(msgs)
-    joins = len([e for e in evts if e["event_type"]=="join"])
-    leaves = len([e for e in evts if e["event_type"]=="leave"])
-
-    # Profanity leaderboard
-    profane_msgs = [m for m in msgs if m["profane"] if not USE_DATABASE else getattr(m, "profane")]
-    prof_users = Counter([m["username"] if not USE_DATABASE else m.username for m in profane_msgs])
-    
-    # Top hashtags
-    all_hashtags = []
-    for m in msgs:
-        tags = m["hashtags"] if not USE_DATABASE else extract_hashtags(m.text)
-        all_hashtags.extend(tags)
-    top_hashtags = Counter(all_hashtags)
-
-    # Top 5 each
-    leaderboard = prof_users.most_common(5)
-    top5_hashtags = top_hashtags.most_common(5)
-
-    html = f"""
-    <html>
-    <head>
-      <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-      <link href="https://cdn.jsdelivr.net/npm/tailwindcss@3.3.3/dist/tailwind.min.css" rel="stylesheet">
-    </head>
-    <body class="bg-gray-100 p-6">
-      <div class="max-w-4xl mx-auto bg-white p-6 rounded-xl shadow-lg">
-        <h2 class="text-2xl font-bold mb-4">Telegram Analytics Dashboard</h2>
-        <p class="mb-2">Total Messages: {total_messages}</p>
-        <p class="mb-2">Joins: {joins} | Leaves: {leaves}</p>
-
-        <canvas id="myChart" class="mb-6"></canvas>
-
-        <h3 class="text-xl font-semibold mt-4 mb-2">Top Hashtags</h3>
-        <ul class="list-disc list-inside">
-          {''.join(f"<li>{tag}: {count}</li>" for tag, count in top5_hashtags)}
-        </ul>
-
-        <h3 class="text-xl font-semibold mt-4 mb-2">Profanity Leaderboard</h3>
-        <ul class="list-disc list-inside">
-          {''.join(f"<li>{user}: {count}</li>" for user, count in leaderboard)}
-        </ul>
-
-      </div>
-      <script>
-      var ctx = document.getElementById('myChart').getContext('2d');
-      var chart = new Chart(ctx, {{
-          type: 'bar',
-          data: {{
-              labels: ['Messages','Joins','Leaves'],
-              datasets: [{{
-                  label: 'Counts',
-                  data: [{total_messages},{joins},{leaves}],
-                  backgroundColor: ['blue','green','red']
-              }}]
-          }},
-          options: {{}}
-      }});
-      </script>
-    </body>
-    </html>
-    """
-    return render_template_string(html)
+# Compiled once at import; per-request cost is just render() over the
+# current counter values instead of a Jinja parse + compile per hit.
+DASH_TPL = Template("""
+<html>
+<head>
+  <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+  <link href="https://cdn.jsdelivr.net/npm/tailwindcss@3.3.3/dist/tailwind.min.css" rel="stylesheet">
+</head>
+<body class="bg-gray-100 p-6">
+  <div class="max-w-4xl mx-auto bg-white p-6 rounded-xl shadow-lg">
+    <h2 class="text-2xl font-bold mb-4">Telegram Analytics Dashboard</h2>
+    <p class="mb-2">Total Messages: {{ total_messages }}</p>
+    <p class="mb-2">Joins: {{ joins }} | Leaves: {{ leaves }}</p>
+
+    <canvas id="myChart" class="mb-6"></canvas>
+
+    <h3 class="text-xl font-semibold mt-4 mb-2">Top Hashtags</h3>
+    <ul class="list-disc list-inside">
+      {% for tag, count in top5_hashtags %}<li>{{ tag }}: {{ count }}</li>{% endfor %}
+    </ul>
+
+    <h3 class="text-xl font-semibold mt-4 mb-2">Profanity Leaderboard</h3>
+    <ul class="list-disc list-inside">
+      {% for user, count in leaderboard %}<li>{{ user }}: {{ count }}</li>{% endfor %}
+    </ul>
+
+  </div>
+  <script>
+  var ctx = document.getElementById('myChart').getContext('2d');
+  var chart = new Chart(ctx, {
+      type: 'bar',
+      data: {
+          labels: ['Messages','Joins','Leaves'],
+          datasets: [{
+              label: 'Counts',
+              data: [{{ total_messages }},{{ joins }},{{ leaves }}],
+              backgroundColor: ['blue','green','red']
+          }]
+      },
+      options: {}
+  });
+  </script>
+</body>
+</html>
+""")
+
+async def dashboard(request):
+    # Everything is maintained incrementally; no storage round-trip here,
+    # and no locks since the counters live on this same loop.
+    html = DASH_TPL.render(
+        total_messages=STATS["messages"],
+        joins=STATS["joins"],
+        leaves=STATS["leaves"],
+        top5_hashtags=HASHTAG_COUNTER.most_common(5),
+        leaderboard=PROFANE_COUNTER.most_common(5),
+    )
+    return web.Response(text=html, content_type="text/html")
+
+webapp = web.Application()
+webapp.router.add_get("/dashboard", dashboard)
 
 # -------------------------------
-# Run Flask + Bot Together
+# Run Dashboard + Bot on One Loop
 # -------------------------------
 async def main():
-    def run_flask():
-        app.run(host="0.0.0.0", port=int(os.environ.get("PORT",5000)))
-    Thread(target=run_flask).start()
-    await dp.start_polling(bot)
+    global AIO_SESSION, FLUSHER_TASK
+    AIO_SESSION = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=5),
+        json_serialize=lambda obj: orjson.dumps(obj).decode(),
+    )
+    if USE_DATABASE:
+        await ensure_schema()
+        await rebuild_counters()
+    runner = web.AppRunner(webapp)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", int(os.environ.get("PORT",5000)))
+    await site.start()
+    FLUSHER_TASK = asyncio.create_task(flusher())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        FLUSHER_TASK.cancel()
+        await flush_pending()  # don't strand buffered rows on shutdown
 
 if __name__ == "__main__":
     asyncio.run(main())